@@ -0,0 +1,86 @@
+###############################################################################
+'''
+    Load generator for the input queue manager. Starts a QueueManager on
+    localhost, like backend.main() does, with a process draining the queue,
+    then pushes posts through the manager path and reports posts/sec.
+
+    python -m benchmarks.ingest_load --posts 100000 --connections 4 --batch_size 500
+'''
+###############################################################################
+import asyncio
+import time
+from multiprocessing import Process
+
+from ingest.client import AsyncIngestClient
+from ingest.messageq import QueueWrapper, create_queue_manager, register_manager
+from ingest.models import Post
+
+
+def drain(q: QueueWrapper):
+    for _ in iter(q.get, 'STOP'):
+        pass
+
+
+def make_posts(count: int, size: int):
+    content = 'x' * size
+    return [Post(content=content, publication=f'pub-{i % 20}') for i in range(count)]
+
+
+def sync_baseline(port: int, posts):
+    '''One blocking proxy call per post, the way a front-end used to feed the backend.'''
+    register_manager('iqueue')
+    manager = create_queue_manager(port)
+    manager.connect()
+    q = manager.iqueue()
+    start = time.perf_counter()
+    for post in posts:
+        q.put(post)
+    return len(posts) / (time.perf_counter() - start)
+
+
+async def async_client(port: int, posts, connections: int, batch_size: int, in_flight: int):
+    async with AsyncIngestClient(port=port, connections=connections, batch_size=batch_size,
+                                 max_in_flight=in_flight) as client:
+        start = time.perf_counter()
+        await client.put_many(posts)
+    return len(posts) / (time.perf_counter() - start)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', default=100_000, type=int)
+    parser.add_argument('--size', default=2_000, type=int, help='bytes of content per post')
+    parser.add_argument('--port', default=50_111, type=int)
+    parser.add_argument('--connections', default=4, type=int)
+    parser.add_argument('--batch_size', default=500, type=int)
+    parser.add_argument('--in_flight', default=8, type=int)
+    parser.add_argument('--drainers', default=2, type=int)
+    parser.add_argument('--baseline_posts', default=5_000, type=int)
+    args = parser.parse_args()
+
+    iq = QueueWrapper('iqueue', validator=Post.validate)
+    register_manager('iqueue', iq)
+    server = create_queue_manager(args.port)
+    server.start()
+    drainers = [Process(target=drain, args=(iq,)) for _ in range(args.drainers)]
+    for p in drainers:
+        p.start()
+
+    try:
+        rate = sync_baseline(args.port, make_posts(args.baseline_posts, args.size))
+        print(f'sync put per post : {rate:10.0f} posts/sec')
+        rate = asyncio.run(async_client(args.port, make_posts(args.posts, args.size),
+                                        args.connections, args.batch_size, args.in_flight))
+        print(f'async client      : {rate:10.0f} posts/sec '
+              f'({args.connections} connections, batches of {args.batch_size}, {args.in_flight} in flight)')
+    finally:
+        for _ in drainers:
+            iq.q.put('STOP')
+        for p in drainers:
+            p.join()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
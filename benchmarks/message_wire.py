@@ -0,0 +1,72 @@
+###############################################################################
+'''
+    Measures construct + pickle + unpickle throughput of the queue messages,
+    comparing the __slots__ models in ingest.models with the pydantic models
+    they replaced. Needs pydantic installed for the comparison.
+
+    python -m benchmarks.message_wire --messages 100000
+'''
+###############################################################################
+import pickle
+import time
+from collections import Counter
+
+from ingest import models
+
+
+def pydantic_models():
+    from pydantic import BaseModel
+
+    class Post(BaseModel):
+        content: str
+        publication: str
+
+    class ProcessedPost(BaseModel):
+        publication: str
+        entities: Counter = Counter()
+        article_count: int = 0
+
+    # pickle looks classes up by name, so they have to be reachable from this module
+    globals().update(PydanticPost=Post, PydanticProcessedPost=ProcessedPost)
+    Post.__qualname__, ProcessedPost.__qualname__ = 'PydanticPost', 'PydanticProcessedPost'
+    return Post, ProcessedPost
+
+
+def run(post_cls, processed_cls, count: int, content: str, entities: Counter):
+    size = 0
+    start = time.perf_counter()
+    for i in range(count):
+        post = pickle.dumps(post_cls(content=content, publication='The Daily Benchmark'))
+        processed = pickle.dumps(processed_cls(
+            publication='The Daily Benchmark', entities=entities, article_count=1))
+        pickle.loads(post)
+        pickle.loads(processed)
+        size += len(post) + len(processed)
+    elapsed = time.perf_counter() - start
+    return count / elapsed, size / count
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', default=100_000, type=int)
+    parser.add_argument('--content_size', default=2_000, type=int)
+    parser.add_argument('--entities', default=20, type=int)
+    args = parser.parse_args()
+
+    content = 'x' * args.content_size
+    entities = Counter({f'entity {i}': i + 1 for i in range(args.entities)})
+
+    candidates = [('slots', models.Post, models.ProcessedPost)]
+    try:
+        candidates.append(('pydantic', *pydantic_models()))
+    except ImportError:
+        print('pydantic is not installed, only measuring the slots models')
+
+    for name, post_cls, processed_cls in candidates:
+        rate, size = run(post_cls, processed_cls, args.messages, content, entities)
+        print(f'{name:<9}: {rate:10.0f} post pairs/sec, {size:7.0f} bytes pickled per pair')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+###############################################################################
+'''
+    Compares the docs/sec of the one call per message loop used by Worker
+    against the batched nlp.pipe path.
+
+    python -m benchmarks.nlp_batch --docs 2000 --batch_sizes 1 16 64 256
+'''
+###############################################################################
+import random
+import time
+from typing import List
+
+from ingest.models import Post
+from ingest.processor import DataProcessor
+
+NAMES = ['Alice Smith', 'Google', 'Paris', 'the United Nations', 'Microsoft',
+         'Barack Obama', 'London', 'Amazon', 'the European Union', 'Tokyo']
+FILLER = ['said on Monday that', 'announced plans to', 'is expected to',
+          'met with officials from', 'reported strong growth in']
+
+
+def make_posts(count: int, sentences: int = 8, seed: int = 42) -> List[Post]:
+    rnd = random.Random(seed)
+    posts = []
+    for i in range(count):
+        text = ' '.join(
+            f'{rnd.choice(NAMES)} {rnd.choice(FILLER)} {rnd.choice(NAMES)}.'
+            for _ in range(sentences)
+        )
+        posts.append(Post(content=text, publication=f'pub-{i % 10}'))
+    return posts
+
+
+def per_message(processor: DataProcessor, posts: List[Post]) -> float:
+    start = time.perf_counter()
+    for post in posts:
+        processor.process_message(post)
+    return len(posts) / (time.perf_counter() - start)
+
+
+def batched(processor: DataProcessor, posts: List[Post], batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(posts), batch_size):
+        for _ in processor.process_messages(posts[i:i + batch_size], batch_size):
+            pass
+    return len(posts) / (time.perf_counter() - start)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', default=2_000, type=int)
+    parser.add_argument('--batch_sizes', default=[16, 64, 256], type=int, nargs='+')
+    args = parser.parse_args()
+
+    processor = DataProcessor()
+    posts = make_posts(args.docs)
+    # warm up the model so the first measurement doesn't pay for lazy init
+    processor.process_message(posts[0])
+
+    print(f'per message loop    : {per_message(processor, posts):10.1f} docs/sec')
+    for size in args.batch_sizes:
+        print(f'nlp.pipe batch {size:<5}: {batched(processor, posts, size):10.1f} docs/sec')
+
+
+if __name__ == '__main__':
+    main()
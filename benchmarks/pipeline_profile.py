@@ -0,0 +1,61 @@
+###############################################################################
+'''
+    Compares spacy pipeline profiles: docs/sec, peak RSS per worker process,
+    and whether the trimmed profiles extract exactly the same entities as the
+    full pipeline on a fixed corpus.
+
+    python -m benchmarks.pipeline_profile --model en_core_web_sm --docs 2000
+'''
+###############################################################################
+import multiprocessing
+import resource
+import time
+
+from benchmarks.nlp_batch import make_posts
+
+CONFIGS = [
+    ('full', False),
+    ('ner', False),
+    ('ner', True),
+]
+
+
+def measure(model: str, profile: str, skip_in_pipeline: bool, docs: int, results):
+    # imported here so the spawned process pays for loading spacy itself
+    from ingest.processor import DataProcessor
+
+    processor = DataProcessor(model=model, profile=profile, skip_in_pipeline=skip_in_pipeline)
+    posts = make_posts(docs)
+    start = time.perf_counter()
+    entities = [p.entities for p in processor.process_messages(posts, 64)]
+    rate = docs / (time.perf_counter() - start)
+    # ru_maxrss is in KiB on linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((rate, rss, entities, list(processor.nlp.pipe_names)))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='en_core_web_sm')
+    parser.add_argument('--docs', default=2_000, type=int)
+    args = parser.parse_args()
+
+    # spawn gives every profile a fresh process, so RSS isn't shared with the others
+    ctx = multiprocessing.get_context('spawn')
+    baseline = None
+    for profile, skip_in_pipeline in CONFIGS:
+        results = ctx.Queue()
+        p = ctx.Process(target=measure, args=(args.model, profile, skip_in_pipeline, args.docs, results))
+        p.start()
+        rate, rss, entities, pipe_names = results.get()
+        p.join()
+
+        baseline = baseline or entities
+        same = 'same entities' if entities == baseline else 'DIFFERENT entities'
+        print(f'{profile:<5} skip_in_pipeline={skip_in_pipeline!s:<5}: {rate:8.1f} docs/sec, '
+              f'peak rss {rss:7.1f} MiB, {same}, pipeline {pipe_names}')
+
+
+if __name__ == '__main__':
+    main()
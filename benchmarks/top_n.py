@@ -0,0 +1,58 @@
+###############################################################################
+'''
+    Compares top-N entity selection used by transform_for_database against
+    sorting the whole Counter with most_common().
+
+    python -m benchmarks.top_n --entities 1000000 --top_n 2000
+'''
+###############################################################################
+import random
+import time
+import tracemalloc
+from collections import Counter
+
+from ingest.models import ProcessedPost
+
+
+def make_post(entities: int, seed: int = 42) -> ProcessedPost:
+    rnd = random.Random(seed)
+    # a long tail of rarely mentioned entities, like real publications have
+    counts = Counter({f'entity-{i}': int(rnd.paretovariate(1.2)) for i in range(entities)})
+    return ProcessedPost(publication='Benchmark Times', entities=counts, article_count=entities // 10)
+
+
+def naive(post: ProcessedPost, top_n: int) -> int:
+    docs = [(post.pub_key, 'entities', name, {'name': name, 'count': count})
+            for name, count in post.entities.most_common()[:top_n]]
+    return len(docs)
+
+
+def streaming(post: ProcessedPost, top_n: int) -> int:
+    return sum(1 for _ in post.transform_for_database(top_n))
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entities', default=1_000_000, type=int)
+    parser.add_argument('--top_n', default=2000, type=int)
+    args = parser.parse_args()
+
+    post = make_post(args.entities)
+    for name, fn in [('most_common()', naive), ('heapq top-n', streaming)]:
+        elapsed, peak = measure(fn, post, args.top_n)
+        print(f'{name:<14}: {elapsed * 1000:8.1f} ms, peak {peak / 2**20:7.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+###############################################################################
+'''
+    Throughput and latency of the QueueWrapper transports: the default
+    multiprocessing.Queue against the shared memory ring buffer.
+
+    python -m benchmarks.transport --messages 20000 --sizes 64 1024 16384 --procs 1 4
+'''
+###############################################################################
+import statistics
+import time
+from multiprocessing import Process, Queue
+
+from ingest.backend import create_queue
+from ingest.messageq import QueueWrapper
+
+
+def producer(q: QueueWrapper, count: int, size: int):
+    payload = b'x' * size
+    for _ in range(count):
+        q.put((time.monotonic(), payload))
+
+
+def consumer(q: QueueWrapper, results: Queue):
+    latencies = []
+    for msg in iter(q.get, 'STOP'):
+        latencies.append(time.monotonic() - msg[0])
+    results.put(latencies)
+
+
+def run(transport: str, messages: int, size: int, procs: int):
+    q = QueueWrapper('bench', q=create_queue(transport))
+    results = Queue()
+    consumers = [Process(target=consumer, args=(q, results)) for _ in range(procs)]
+    producers = [Process(target=producer, args=(q, messages // procs, size)) for _ in range(procs)]
+
+    start = time.perf_counter()
+    for p in consumers + producers:
+        p.start()
+    for p in producers:
+        p.join()
+    for _ in consumers:
+        q.q.put('STOP')
+    latencies = [l for _ in consumers for l in results.get()]
+    elapsed = time.perf_counter() - start
+    for p in consumers:
+        p.join()
+
+    latencies.sort()
+    return {
+        'msgs_per_sec': len(latencies) / elapsed,
+        'p50_us': statistics.median(latencies) * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+    }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', default=20_000, type=int)
+    parser.add_argument('--sizes', default=[64, 1024, 16384], type=int, nargs='+')
+    parser.add_argument('--procs', default=[1, 4], type=int, nargs='+', help='producers and consumers each')
+    args = parser.parse_args()
+
+    for procs in args.procs:
+        for size in args.sizes:
+            for transport in ['queue', 'shm']:
+                r = run(transport, args.messages, size, procs)
+                print(f'{transport:<6} procs={procs:<2} size={size:<6}: {r["msgs_per_sec"]:10.0f} msgs/sec'
+                      f'  p50 {r["p50_us"]:9.0f} us  p99 {r["p99_us"]:9.0f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -12,18 +12,23 @@
                       |_> Worker() _|
 '''
 ###############################################################################
+import gc
+import multiprocessing
 import os
 import signal
+import time
 from collections import defaultdict
 from multiprocessing import Process
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
-from .debugging import app_logger as log
+from .debugging import app_logger as log, rss_mib
 from .messageq import QueueWrapper, create_queue_manager, register_manager
-from .models import ProcessedPost
-from .persistence import get_database_client, persist, persist_no_op
+from .models import Post, ProcessedPost
+from .persistence import WriteBuffer, get_database_client, persist_batch, persist_no_op
 from .processor import DataProcessor
+from .shmqueue import ShmQueue
 from .shutdownwatcher import ShutdownWatcher
+from .supervisor import Pool, Supervisor
 
 
 class Worker(Process):
@@ -31,13 +36,37 @@ class Worker(Process):
     fetching data from the input queue and extracting known entities.
     '''
 
-    def __init__(self, inq: QueueWrapper, outq: QueueWrapper, cache_size: int = 25_000):
-        # initially we ignored everything related to caching
+    def __init__(self, inq: QueueWrapper, outq: QueueWrapper, cache_size: int = 25_000,
+                 batch_size: int = 1, batch_linger_ms: int = 0,
+                 flush_interval: float = 30.0, max_entities: int = 100_000, processor_args: Dict = None,
+                 processor: DataProcessor = None):
         # we first set up the reference variables
         # the colons are just annotations again
         self.iq: QueueWrapper = inq
         self.oq: QueueWrapper = outq 
 
+        # batch_size is the max number of posts handed to spacy's nlp.pipe in one go
+        # and batch_linger is how long (in seconds) we wait for a batch to fill up.
+        # A batch_size of 1 keeps the original one message at a time behaviour.
+        self._batch_size = max(batch_size, 1)
+        self._batch_linger = batch_linger_ms / 1000
+
+        # The aggregation cache merges processed posts per publication so that we
+        # send one set of documents per publication instead of one per article.
+        # It is flushed once cache_size articles are cached, once flush_interval
+        # seconds have passed since the last flush, or when the worker stops.
+        # A single publication is flushed early once it holds max_entities distinct
+        # entities, which keeps memory bounded for very noisy publications.
+        self._cache_size = max(cache_size, 1)
+        self._flush_interval = flush_interval
+        self._max_entities = max_entities
+        self.reset_cache()
+
+        # keyword arguments for the DataProcessor created in run
+        # unless the parent already loaded one for us to share, see preload_processor
+        self._processor_args = processor_args or {}
+        self._processor = processor
+
         # we also need to make sure that we call the init method from our super class
         super(Worker, self).__init__()
 
@@ -51,27 +80,80 @@ class Worker(Process):
         # The reason for this is that out QueueWrapper does not allow writes after 
         # prevent_writes is called, so we circumvent it and access the underlying Queue instance
         # now when the process is sent a SIGTERM, is going to enqueue a 'STOP' message
-
-
-
+        # the run loop flushes the cache once it pulls that message
 
     def count(self, incr_num: int = None) -> int:
         '''Count increments the counter by the given value and returns the total.
         If no value is given, the current count is returned.
         '''
-        return 0
+        if incr_num:
+            self._count += incr_num
+        return self._count
 
     def reset_cache(self):
-        pass
+        self._cache: Dict[str, ProcessedPost] = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
 
     def cache(self, msg: ProcessedPost) -> int:
         '''Caches messages until flush_cache is called.
         Returns the number of currently cached values.
         '''
-        return 0
+        cached = self._cache.get(msg.publication)
+        if cached is None:
+            self._cache[msg.publication] = cached = msg
+        else:
+            cached + msg
+        self.count(msg.article_count)
+
+        if len(cached.entities) >= self._max_entities:
+            log.debug(f'flushing {msg.publication} early, {len(cached.entities)} entities cached')
+            self.flush_publication(msg.publication)
+        return self.count()
+
+    def flush_publication(self, pubname: str):
+        '''Sends the cached documents of a single publication to the output queue.'''
+        post = self._cache.pop(pubname, None)
+        if post is None:
+            return
+        self.oq.put_many(post.transform_for_database())
+        self._count -= post.article_count
 
     def flush_cache(self):
-        pass
+        for pubname in list(self._cache):
+            self.flush_publication(pubname)
+        self.reset_cache()
+
+    def flush_due_in(self) -> float:
+        '''Seconds until the cache should be flushed on time.
+        Returns None when there is nothing cached, since there is nothing to wait for.
+        '''
+        if not self._cache:
+            return None
+        return max(self._last_flush + self._flush_interval - time.monotonic(), 0)
+
+    def next_batch(self, timeout: float = None) -> List[object]:
+        '''Blocks until at least one message is available, then keeps pulling messages
+        until batch_size messages are collected or the linger time runs out.
+        If the sentinel STOP is pulled it is always the last item in the batch.
+        Returns an empty list if nothing arrives within the given timeout.
+        '''
+        batch = self.iq.get_many(self._batch_size, timeout=timeout)
+        if not batch:
+            return batch
+        deadline = time.monotonic() + self._batch_linger
+        while len(batch) < self._batch_size and batch[-1] != 'STOP':
+            # a timeout of 0 still takes whatever is already sitting on the queue
+            more = self.iq.get_many(self._batch_size - len(batch), timeout=max(deadline - time.monotonic(), 0))
+            if not more:
+                break
+            batch.extend(more)
+        return batch
+
+    def process(self, processor: DataProcessor, posts: List[object]) -> Iterable[ProcessedPost]:
+        if len(posts) == 1:
+            return [processor.process_message(posts[0])]
+        return processor.process_messages(posts, self._batch_size)
 
     def run(self):
         # Register the shutdown handler for this process.
@@ -87,36 +169,40 @@ class Worker(Process):
         # Spacy can take up a bit of memory when loaded. The amount depends on
         # which model is used. If we instantiate in __init__ the process
         # that creates Workers ends up using more memory than needed.
-        processor = DataProcessor()
-
-        # self.iq.get() is a blocking call.
-        # This will repeatedly call get and wait for an object to be
-        # pulled from the queue until the get call returns the sentinel 'STOP'
-
-        # this is the uncached method 
-        for msg in iter(self.iq.get, 'STOP'):
-            self.oq.put(processor.process(msg))
-
-        '''
-            see now my understanding is it continuously get() messages from input queue iq and stores them
-            inside the output queue 'oq' until it comes across the message 'STOP' from the input queue
-            which has been put in place by the shutdown method directly into the underlying q.
-            ONCE that message is matched, the loop stops
-        '''
-
-        # # this is the cached method 
-        # for msg in iter(self.iq.get, 'STOP'):
-        #     if self.cache(processor.process_message(msg)) == self._cache_size:
-        #         self.flush_cache()
-        # # Leaving the process with a status code of 0, if all went well.
-        # self.flush_cache()
+        # The exception is the preload mode, where the parent loads it once and every
+        # forked worker shares the same copy on write memory.
+        start = time.perf_counter()
+        processor = self._processor or DataProcessor(**self._processor_args)
+        log.info(f'worker ready in {(time.perf_counter() - start) * 1000:.0f}ms '
+                 f'({"preloaded" if self._processor else "loaded"} model)')
+
+        # next_batch blocks until it pulls something off the queue, but never for
+        # longer than it takes for the cache to be due for a flush.
+        # We keep going until we pull the sentinel 'STOP'.
+        while True:
+            batch = self.next_batch(timeout=self.flush_due_in())
+            stop = bool(batch) and batch[-1] == 'STOP'
+            posts = batch[:-1] if stop else batch
+
+            for msg in self.process(processor, posts):
+                self.cache(msg)
+
+            if stop:
+                break
+            if self.count() >= self._cache_size or self.flush_due_in() == 0:
+                self.flush_cache()
+
+        # Leaving the process with a status code of 0, if all went well.
+        self.flush_cache()
+        if processor.cache is not None:
+            log.info(f'entity cache stats: {processor.cache.stats()}')
         exit(0)
 
 
 class Saver(Process):
-    '''Saver pulls messages off the queue and passes the message and client to the persist_fn.'''
+    '''Saver pulls messages off the queue and passes batches of them with the client to the persist_fn.'''
     # arguments are the output queue, the database client, and the persistance function 
-    def __init__(self, q: QueueWrapper, client, persist_fn):
+    def __init__(self, q: QueueWrapper, client, persist_fn, batch_size: int = 500, flush_interval: float = 5.0):
         # first thing we check is that the persistence function is callable
         # we need our code to fail early if we recieve something we don't expect
         # this checks if the function is even callable, if not it stops before doing real work
@@ -125,24 +211,42 @@ class Saver(Process):
         self.client = client
         self.persist_fn = persist_fn
 
+        # Messages are buffered and merged by document before they are persisted.
+        # The buffer is flushed once it holds batch_size distinct documents, once the
+        # oldest buffered document is flush_interval seconds old, or on shutdown.
+        self._batch_size = max(batch_size, 1)
+        self._flush_interval = flush_interval
+        super(Saver, self).__init__()
+
     def shutdown(self, *args):
         log.info('shutting down saver')
         self.q.q.put('STOP')
 
+    def flush(self, buffer: WriteBuffer):
+        if len(buffer):
+            self.persist_fn(self.client, buffer.drain())
+
     def run(self):
         # same as for worker
         signal.signal(signal.SIGTERM, self.shutdown)
 
-        # see worker notes 
-        # this loop has been modified, the messages we get() from our queue are going to be
-        # passed to our persistence function instead
-        # this function accepts a client and then some additional arguments
-        # client, pubname, collname, doc_id, document_dict
-        # at the moment (sprint 5 part 1) the 'msg' is a dictionary returned by processor.process
-        # we are going to change that into a tuple that matches the arguments required for persist
-        for msg in iter(self.q.get, 'STOP'):
-            self.persist_fn(self.client, *msg)
-
+        # the messages we get() from our queue are (pubname, collname, doc_id, document_dict)
+        # tuples produced by ProcessedPost.transform_for_database
+        # persist_fn is called with the client and a list of those tuples
+        buffer = WriteBuffer()
+        stop = False
+        while not stop:
+            # only wait as long as the oldest buffered document is allowed to wait
+            timeout = max(self._flush_interval - buffer.age, 0) if len(buffer) else None
+            for msg in self.q.get_many(self._batch_size, timeout=timeout):
+                if msg == 'STOP':
+                    stop = True
+                    break
+                buffer.add(*msg)
+            if len(buffer) >= self._batch_size or buffer.age >= self._flush_interval:
+                self.flush(buffer)
+
+        self.flush(buffer)
         exit(0)
 
 
@@ -176,13 +280,37 @@ def shutdown(q: QueueWrapper, procs: List[Process]):
     # next we send each of the processes a SIGTERM signal using LIST COMPREHENSION 
     # processes 'p' in procs have all inherited the methods and properties of Process
     # so this signal them to execute their shutdown method 
-    [os.kill(p.pid, signal.SIGTERM) for p in procs]
+    # processes that already exited (crashed or scaled down) can't be signaled
+    [os.kill(p.pid, signal.SIGTERM) for p in procs if p.is_alive()]
     log.info(f"joining processes")
     # join makes sure the child processes are all complete/shutdown before the parent
     # process is shut down
     [p.join() for p in procs]
 
 
+def preload_processor(processor_args: Dict) -> DataProcessor:
+    '''Loads the DataProcessor once, in this process, so forked workers can share it.
+    Returns None if processes aren't forked, in which case workers load their own.
+    '''
+    if multiprocessing.get_start_method() != 'fork':
+        log.warning('preloading the model needs the fork start method, workers will load their own')
+        return None
+
+    rss_before = rss_mib()
+    start = time.perf_counter()
+    processor = DataProcessor(**processor_args)
+    load_time = time.perf_counter() - start
+    model_mib = rss_mib() - rss_before
+
+    # gc.freeze moves every object tracked so far into a permanent generation which the
+    # garbage collector never scans. Otherwise a collection in a worker would write to the
+    # model's objects and each worker would end up with a private copy of those pages.
+    gc.freeze()
+    log.info(f'preloaded model in {load_time:.2f}s using {model_mib:.0f} MiB, '
+             f'each forked worker saves that load time and shares the memory')
+    return processor
+
+
 def register_shutdown_handlers(queues, processes):
     '''Create shutdown handlers to be kicked off on exit.'''
     def shutdown_gracefully():
@@ -193,14 +321,46 @@ def register_shutdown_handlers(queues, processes):
     atexit.register(shutdown_gracefully)
 
 
+def create_queue(transport: str, shm_queue_mb: int = 64):
+    '''Returns the underlying queue used by a QueueWrapper for the given transport.
+    None means QueueWrapper creates its default multiprocessing.Queue.
+    '''
+    if transport == 'shm':
+        return ShmQueue(capacity=shm_queue_mb * 2**20)
+    return None
+
+
 def main():
     pcount = (os.cpu_count() - 1) or 1
     parser_arguments = [
         ('--iproc_num', {'help': 'number of input queue workers', 'default': pcount, 'type': int}),  # noqa
         ('--oproc_num', {'help': 'number of output queue workers', 'default': pcount, 'type': int}),  # noqa
+        ('--iproc_bounds', {'help': 'min and max number of workers when autoscaling', 'default': None, 'type': int, 'nargs': 2}),  # noqa
+        ('--oproc_bounds', {'help': 'min and max number of savers when autoscaling', 'default': None, 'type': int, 'nargs': 2}),  # noqa
+        ('--iq_scale_depths', {'help': 'input queue depth to add a worker at and to remove one at', 'default': [1_000, 10], 'type': int, 'nargs': 2}),  # noqa
+        ('--oq_scale_depths', {'help': 'output queue depth to add a saver at and to remove one at', 'default': [5_000, 50], 'type': int, 'nargs': 2}),  # noqa
+        ('--supervise_interval', {'help': 'seconds between process health checks', 'default': 1.0, 'type': float}),  # noqa
         ('--iport', {'help': 'input queue port cross proc messaging', 'default': 50_000, 'type': int}),  # noqa
         ('--no_persistence', {'help': 'disable database persistence', 'action': 'store_true'}),  # noqa
         ('--agg_cache_size', {'help': 'aggregator cache size', 'default': 25_000, 'type': int}),  # noqa
+        ('--agg_flush_interval', {'help': 'max seconds between aggregator cache flushes', 'default': 30.0, 'type': float}),  # noqa
+        ('--agg_max_entities', {'help': 'distinct entities that force an early publication flush', 'default': 100_000, 'type': int}),  # noqa
+        ('--save_batch_size', {'help': 'distinct documents buffered by a saver before writing', 'default': 500, 'type': int}),  # noqa
+        ('--save_flush_interval', {'help': 'max seconds a document waits in the saver buffer', 'default': 5.0, 'type': float}),  # noqa
+        ('--model', {'help': 'name or path of the spacy model', 'default': 'en_core_web_sm'}),  # noqa
+        ('--pipeline_profile', {'help': 'spacy components to load, ner drops everything ner does not need', 'default': 'ner', 'choices': ['full', 'ner']}),  # noqa
+        ('--skip_in_pipeline', {'help': 'drop skipped entity labels inside the spacy pipeline', 'action': 'store_true'}),  # noqa
+        ('--preload_model', {'help': 'load the model once and fork workers that share it', 'action': 'store_true'}),  # noqa
+        ('--entity_cache_size', {'help': 'texts per worker in the in-memory entity cache, 0 disables it', 'default': 10_000, 'type': int}),  # noqa
+        ('--entity_cache_path', {'help': 'SQLite file for an entity cache shared by all workers', 'default': None}),  # noqa
+        ('--transport', {'help': 'queue implementation used between processes', 'default': 'queue', 'choices': ['queue', 'shm']}),  # noqa
+        ('--shm_queue_mb', {'help': 'size of each shared memory queue in MiB', 'default': 64, 'type': int}),  # noqa
+        ('--iq_watermarks', {'help': 'input queue high and low watermark in posts, 0 0 for unbounded', 'default': [50_000, 25_000], 'type': int, 'nargs': 2}),  # noqa
+        ('--oq_watermarks', {'help': 'output queue high and low watermark in documents, 0 0 for unbounded', 'default': [200_000, 100_000], 'type': int, 'nargs': 2}),  # noqa
+        ('--put_timeout', {'help': 'seconds a throttled front-end put waits before QueueFull is raised', 'default': 30.0, 'type': float}),  # noqa
+        ('--stats_interval', {'help': 'seconds between queue stats log lines', 'default': 60.0, 'type': float}),  # noqa
+        ('--nlp_batch_size', {'help': 'max posts per nlp.pipe batch, 1 disables batching', 'default': 1, 'type': int}),  # noqa
+        ('--nlp_batch_linger_ms', {'help': 'max milliseconds to wait for a batch to fill', 'default': 50, 'type': int}),  # noqa
     ]
 
     import argparse
@@ -214,16 +374,35 @@ def main():
     oproc_num = args.oproc_num
     iport = args.iport
     cache_sz = args.agg_cache_size
+    batch_sz = args.nlp_batch_size
+    batch_linger = args.nlp_batch_linger_ms
+    flush_interval = args.agg_flush_interval
+    max_entities = args.agg_max_entities
+    processor_args = {
+        'cache_size': args.entity_cache_size,
+        'cache_path': args.entity_cache_path,
+        'model': args.model,
+        'profile': args.pipeline_profile,
+        'skip_in_pipeline': args.skip_in_pipeline,
+    }
+    save_batch_sz = args.save_batch_size
+    save_interval = args.save_flush_interval
     # A tuple containing the db client and method for persisting message
     # For testing, the no_persistence flag allows us to use a null client with a no op function.
     if args.no_persistence:
         persistable = (None, persist_no_op)
     else:
-        persistable = (get_database_client(), persist)
+        persistable = (get_database_client(), persist_batch)
 
     # Setup the input queue, aggregate queue, and output queue
-    iq = QueueWrapper(name="iqueue")
-    oq = QueueWrapper(name="oqueue")
+    # posts from the front-end are validated once, as they enter the input queue
+    # Both queues are bounded by their high watermark. Throttled workers just wait for the savers,
+    # the front-end gets a QueueFull exception through the proxy after put_timeout seconds.
+    iq = QueueWrapper(name="iqueue", q=create_queue(args.transport, args.shm_queue_mb), validator=Post.validate,
+                      high_watermark=args.iq_watermarks[0], low_watermark=args.iq_watermarks[1],
+                      put_timeout=args.put_timeout)
+    oq = QueueWrapper(name="oqueue", q=create_queue(args.transport, args.shm_queue_mb),
+                      high_watermark=args.oq_watermarks[0], low_watermark=args.oq_watermarks[1])
 
     # Register and start the input queue manager for remote connections.
     # This allows the frontend to put messages on the queue
@@ -232,12 +411,25 @@ def main():
     iserver.start()
 
     # Start up the worker/saver processes
-    iprocs = start_processes(iproc_num, Worker, [iq, oq, cache_sz])
-    oprocs = start_processes(oproc_num, Saver, [oq, *persistable])
+    # Each pool starts with iproc_num/oproc_num processes. Without bounds a pool stays that size,
+    # crashed processes are still restarted by the supervisor.
+    # savers are started first so that they don't inherit a preloaded model
+    oprocs = Pool('saver', Saver, [oq, *persistable, save_batch_sz, save_interval], oq,
+                  *(args.oproc_bounds or [oproc_num, oproc_num]), *args.oq_scale_depths)
+    oprocs.start(oproc_num)
+    processor = preload_processor(processor_args) if args.preload_model else None
+    iprocs = Pool('worker', Worker, [iq, oq, cache_sz, batch_sz, batch_linger, flush_interval, max_entities, processor_args, processor], iq,
+                  *(args.iproc_bounds or [iproc_num, iproc_num]), *args.iq_scale_depths)
+    iprocs.start(iproc_num)
+    if processor:
+        log.info(f'{iproc_num} workers share one model, total RSS of this process {rss_mib():.0f} MiB')
 
     # Setup the shutdown handlers to gracefully shutdown the processes.
-    register_shutdown_handlers([iq, oq], [iprocs, oprocs])
+    register_shutdown_handlers([iq, oq], [iprocs.procs, oprocs.procs])
 
+    # The supervisor replaces the idle wait, it runs every supervise_interval seconds
+    # until we get a SIGINT or SIGTERM.
+    supervisor = Supervisor([iprocs, oprocs], args.stats_interval)
     with ShutdownWatcher() as watcher:
-        watcher.serve_forever()
+        watcher.serve_forever(supervisor.tick, args.supervise_interval)
     exit(0)
\ No newline at end of file
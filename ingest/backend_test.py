@@ -0,0 +1,56 @@
+import pytest
+from collections import Counter
+from queue import Queue
+from .backend import Worker
+from .messageq import QueueWrapper
+from .models import ProcessedPost
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+@pytest.fixture(scope='function')
+def worker():
+    iq = QueueWrapper('testiq', q=Queue())
+    oq = QueueWrapper('testoq', q=Queue())
+    return Worker(iq, oq, batch_size=3, batch_linger_ms=10)
+
+
+def test_next_batch_stops_at_batch_size(worker):
+    worker.iq.put_many(['a', 'b', 'c', 'd'])
+    assert worker.next_batch() == ['a', 'b', 'c']
+    assert worker.next_batch() == ['d']  # the linger time runs out
+
+
+def test_next_batch_ends_with_stop(worker):
+    worker.iq.put_many(['a', 'STOP', 'b'])
+    assert worker.next_batch() == ['a', 'STOP']
+
+
+def test_cache_merges_per_publication(worker):
+    worker.cache(ProcessedPost(publication='a', entities=Counter(x=1), article_count=1))
+    worker.cache(ProcessedPost(publication='a', entities=Counter(x=2, y=1), article_count=1))
+    assert worker.cache(ProcessedPost(publication='b', entities=Counter(x=1), article_count=1)) == 3
+    assert worker._cache['a'].entities == Counter(x=3, y=1)
+    assert worker._cache['a'].article_count == 2
+
+    worker.flush_cache()
+    assert worker.count() == 0
+    assert len(worker.oq.get_many(100, timeout=0)) == 5  # a: totals + 2 entities, b: totals + 1 entity
+
+
+def test_cache_flushes_publication_with_too_many_entities(worker):
+    worker._max_entities = 2
+    worker.cache(ProcessedPost(publication='a', entities=Counter(x=1), article_count=1))
+    worker.cache(ProcessedPost(publication='b', entities=Counter(x=1), article_count=1))
+    assert worker.cache(ProcessedPost(publication='a', entities=Counter(y=1), article_count=1)) == 1
+    assert 'a' not in worker._cache
+    assert len(worker.oq.get_many(100, timeout=0)) == 3
@@ -0,0 +1,129 @@
+##################################################################################################
+'''
+    This module provides an asyncio client for pushing posts to the backend's input queue.
+
+    The backend exposes its input queue through a QueueManager (see messageq.register_manager).
+    Every proxy call is a blocking round trip, so the client runs them in a thread pool and
+    keeps several batches in flight at once, which lets a single crawler process keep all of
+    the backend workers busy.
+
+    Example usage:
+
+    async with AsyncIngestClient(port=50_000) as client:
+        await client.put_many(posts)
+'''
+##################################################################################################
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List
+
+from .debugging import app_logger as log
+from .messageq import QueueFull, create_queue_manager, register_manager
+from .models import Post
+
+
+class AsyncIngestClient(object):
+
+    def __init__(self, port: int = 50_000, name: str = 'iqueue', connections: int = 4,
+                 batch_size: int = 500, max_in_flight: int = 8, retry_delay: float = 0.5):
+        self.port = port
+        self.name = name
+        # proxy calls run on this many threads, each thread keeps its own manager connection
+        self.connections = connections
+        # posts are sent in batches of batch_size with a single put_many round trip
+        self.batch_size = batch_size
+        # the number of batches that may be waiting on the backend at the same time
+        self.max_in_flight = max_in_flight
+        # how long to back off when the backend tells us its queue is full
+        self.retry_delay = retry_delay
+
+        self._executor: ThreadPoolExecutor = None
+        self._local = threading.local()
+        self._in_flight: asyncio.Semaphore = None
+        self._pending: List[Post] = []
+        self._tasks = set()
+        self.sent = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def connect(self):
+        '''Starts the thread pool and checks that the backend can be reached.'''
+        loop = asyncio.get_running_loop()
+        register_manager(self.name)
+        self._executor = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix='ingest-client')
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        # connect once up front so a bad port or a backend that isn't running fails here
+        await loop.run_in_executor(self._executor, self._proxy)
+        log.info(f'connected to {self.name} on port {self.port}')
+
+    def _proxy(self):
+        '''Returns the queue proxy of the calling executor thread, connecting if needed.
+        Proxies keep a connection per thread, so each thread gets its own manager.
+        '''
+        proxy = getattr(self._local, 'proxy', None)
+        if proxy is None:
+            manager = create_queue_manager(self.port)
+            manager.connect()
+            proxy = self._local.proxy = getattr(manager, self.name)()
+        return proxy
+
+    def _put_remote(self, batch: List[Post]):
+        # timeout 0 means the backend tells us straight away when it's throttled,
+        # rather than tying up one of our connections while it waits
+        self._proxy().put_many(batch, 0)
+
+    async def put(self, post: Post):
+        '''Buffers the post and sends a batch once batch_size posts are buffered.'''
+        self._pending.append(post)
+        if len(self._pending) >= self.batch_size:
+            await self._send(self._pending)
+            self._pending = []
+
+    async def put_many(self, posts: Iterable[Post]):
+        '''Sends the posts in batches, keeping up to max_in_flight batches in flight.'''
+        for post in posts:
+            await self.put(post)
+        await self.flush()
+
+    async def flush(self):
+        '''Sends whatever is buffered and waits for every in flight batch to be accepted.'''
+        if self._pending:
+            await self._send(self._pending)
+            self._pending = []
+        tasks, self._tasks = self._tasks, set()
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def close(self):
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    async def _send(self, batch: List[Post]):
+        # waiting here is what limits concurrency, the caller can't get ahead of the backend
+        await self._in_flight.acquire()
+        task = asyncio.ensure_future(self._put_batch(batch))
+        # surface errors from batches that already finished
+        for done in [t for t in self._tasks if t.done()]:
+            self._tasks.discard(done)
+            done.result()
+        self._tasks.add(task)
+
+    async def _put_batch(self, batch: List[Post]):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    await loop.run_in_executor(self._executor, self._put_remote, batch)
+                    self.sent += len(batch)
+                    return
+                except QueueFull:
+                    await asyncio.sleep(self.retry_delay)
+        finally:
+            self._in_flight.release()
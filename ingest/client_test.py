@@ -0,0 +1,31 @@
+import asyncio
+import pytest
+from .client import AsyncIngestClient
+from .messageq import QueueWrapper, create_queue_manager, register_manager
+from .models import Post
+
+
+@pytest.fixture(scope='function')
+def backend():
+    iq = QueueWrapper('testclientq', validator=Post.validate)
+    register_manager('testclientq', iq)
+    server = create_queue_manager(0)  # any free port
+    server.start()
+    yield iq, server.address[1]
+    server.shutdown()
+
+
+def test_put_many_sends_batches(backend):
+    iq, port = backend
+    posts = [Post(content=f'content {i}', publication='pub') for i in range(1200)]
+
+    async def send():
+        async with AsyncIngestClient(port=port, name='testclientq', batch_size=500) as client:
+            await client.put_many(posts)
+            return client.sent
+
+    assert asyncio.run(send()) == 1200
+    received = iq.get_many(2000, timeout=1)
+    while len(received) < 1200:
+        received += iq.get_many(2000, timeout=1)
+    assert sorted(p.content for p in received) == sorted(p.content for p in posts)
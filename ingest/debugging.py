@@ -7,6 +7,7 @@
 
 from multiprocessing import get_logger
 import logging
+import os
 
 def logger(level=logging.INFO) -> logging.Logger:
     log = get_logger() # obtain logger, creates something like an unconfigured instance?
@@ -18,6 +19,17 @@ def logger(level=logging.INFO) -> logging.Logger:
     log.addHandler(handler) # add handler to log
     return log
 
+def rss_mib() -> float:
+    '''Resident set size of the calling process in MiB.
+    Reads /proc on linux and falls back to the peak RSS elsewhere.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
 # Exposing app_logger to be used by other modules.
 app_logger = logger()
 
@@ -0,0 +1,119 @@
+##################################################################################################
+'''
+    This module provides a content addressed cache for extracted entities.
+
+    News feeds deliver the same articles over and over again. Rather than running them through
+    spacy every time, the entities of a text are cached under a hash of the normalized text.
+    There are two tiers:
+    1.) An in-memory LRU cache, local to each worker process.
+    2.) An optional SQLite file shared by all the workers on the host.
+
+    Every key is derived from a namespace as well as the text. The DataProcessor builds the
+    namespace from the model and the labels it skips, so changing either of them invalidates
+    everything that was cached before.
+'''
+##################################################################################################
+
+import hashlib
+import json
+import sqlite3
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from .debugging import app_logger as log
+
+
+def normalize(text: str) -> str:
+    '''Collapses whitespace, case is left alone because the model cares about it.'''
+    return ' '.join(text.split())
+
+
+class EntityCache(object):
+
+    def __init__(self, namespace: str, max_items: int = 10_000, path: str = None):
+        self.namespace = namespace
+        self.max_items = max_items
+        self.path = path
+        self._lru: 'OrderedDict[str, Dict[str, int]]' = OrderedDict()
+        self._db: sqlite3.Connection = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.namespace.encode())
+        digest.update(b'\0')
+        digest.update(normalize(text).encode())
+        return digest.hexdigest()
+
+    @property
+    def db(self) -> Optional[sqlite3.Connection]:
+        # connections can't be shared between processes,
+        # so each worker opens its own the first time it needs one
+        if self._db is None and self.path:
+            self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entity_cache '
+                '(key TEXT PRIMARY KEY, namespace TEXT NOT NULL, entities TEXT NOT NULL)'
+            )
+            # entries from an old model or skip list can never be hit again
+            deleted = self._db.execute('DELETE FROM entity_cache WHERE namespace != ?', (self.namespace,)).rowcount
+            if deleted:
+                log.info(f'entity cache: removed {deleted} stale entries from {self.path}')
+        return self._db
+
+    def get(self, key: str) -> Optional[Counter]:
+        '''Returns a new Counter with the cached entities, or None on a miss.'''
+        entities = self._lru.get(key)
+        if entities is not None:
+            self._lru.move_to_end(key)
+            self.hits += 1
+            # always hand out a copy, the caller is free to merge into it
+            return Counter(entities)
+
+        if self.db is not None:
+            row = self.db.execute('SELECT entities FROM entity_cache WHERE key = ?', (key,)).fetchone()
+            if row:
+                entities = json.loads(row[0])
+                self._remember(key, entities)
+                self.disk_hits += 1
+                return Counter(entities)
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, entities: Counter):
+        self.put_many([(key, entities)])
+
+    def put_many(self, items: Iterable[Tuple[str, Counter]]):
+        rows = []
+        for key, entities in items:
+            entities = dict(entities)
+            self._remember(key, entities)
+            rows.append((key, self.namespace, json.dumps(entities)))
+
+        if rows and self.db is not None:
+            with self.db:
+                self.db.execute('BEGIN')
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO entity_cache (key, namespace, entities) VALUES (?, ?, ?)', rows)
+
+    def _remember(self, key: str, entities: Dict[str, int]):
+        self._lru[key] = entities
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'size': len(self._lru),
+        }
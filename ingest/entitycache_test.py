@@ -0,0 +1,37 @@
+from collections import Counter
+from .entitycache import EntityCache
+
+
+def test_key_normalizes_whitespace_and_includes_namespace():
+    cache = EntityCache('model-a')
+    assert cache.key('Hello  world\n') == cache.key('Hello world')
+    assert cache.key('Hello world') != cache.key('hello world')
+    assert cache.key('Hello world') != EntityCache('model-b').key('Hello world')
+
+
+def test_lru_hits_misses_and_eviction():
+    cache = EntityCache('ns', max_items=2)
+    for text in ['a', 'b', 'c']:
+        cache.put(cache.key(text), Counter({text: 1}))
+    assert cache.get(cache.key('a')) is None
+    assert cache.get(cache.key('c')) == Counter(c=1)
+
+    # callers get a copy they can merge into
+    cache.get(cache.key('c')).update(c=5)
+    assert cache.get(cache.key('c')) == Counter(c=1)
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 1
+
+
+def test_disk_tier_is_shared_and_invalidated(tmp_path):
+    path = str(tmp_path / 'entities.db')
+    writer = EntityCache('ns', max_items=10, path=path)
+    writer.put_many([(writer.key('a'), Counter(a=1)), (writer.key('b'), Counter(b=2))])
+
+    reader = EntityCache('ns', max_items=10, path=path)
+    assert reader.get(reader.key('b')) == Counter(b=2)
+    assert reader.stats()['disk_hits'] == 1
+
+    # a new namespace removes the entries it could never hit
+    EntityCache('other', path=path).db
+    assert EntityCache('ns', path=path).get(reader.key('a')) is None
@@ -0,0 +1,83 @@
+##################################################################################################
+'''
+    This module provides an in-memory stand-in for the Firestore client.
+    It supports the small part of the API used by the persistence module and counts
+    round trips, so we can check how many RPCs a saver would make without a live database.
+'''
+##################################################################################################
+
+from typing import Dict, Tuple
+
+from google.cloud.firestore_v1.transforms import Increment
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        # documents keyed by their full path, e.g. ('publications', 'a', 'entities', 'x')
+        self.docs: Dict[Tuple[str, ...], Dict] = {}
+        self.round_trips = 0
+        self.writes = 0
+
+    def collection(self, name: str) -> 'FakeCollection':
+        return FakeCollection(self, (name,))
+
+    def batch(self) -> 'FakeBatch':
+        return FakeBatch(self)
+
+    def apply(self, path: Tuple[str, ...], data: Dict, merge: bool = False):
+        '''Applies a set() to the stored document, resolving Increment transforms.'''
+        self.writes += 1
+        doc = self.docs.setdefault(path, {}) if merge else {}
+        for k, v in data.items():
+            if isinstance(v, Increment):
+                doc[k] = doc.get(k, 0) + v.value
+            else:
+                doc[k] = v
+        self.docs[path] = doc
+
+
+class FakeCollection(object):
+
+    def __init__(self, client: FakeClient, path: Tuple[str, ...]):
+        self._client = client
+        self.path = path
+
+    def document(self, doc_id: str) -> 'FakeDocument':
+        return FakeDocument(self._client, self.path + (doc_id,))
+
+
+class FakeDocument(object):
+
+    def __init__(self, client: FakeClient, path: Tuple[str, ...]):
+        self._client = client
+        self.path = path
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self._client, self.path + (name,))
+
+    def set(self, data: Dict, merge: bool = False):
+        self._client.round_trips += 1
+        self._client.apply(self.path, data, merge)
+
+    def get(self) -> Dict:
+        self._client.round_trips += 1
+        return dict(self._client.docs.get(self.path, {}))
+
+
+class FakeBatch(object):
+
+    def __init__(self, client: FakeClient):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref: FakeDocument, data: Dict, merge: bool = False):
+        self._writes.append((ref.path, data, merge))
+
+    def commit(self):
+        if len(self._writes) > 500:
+            raise ValueError('a batch may not contain more than 500 writes')
+        self._client.round_trips += 1
+        for path, data, merge in self._writes:
+            self._client.apply(path, data, merge)
+        self._writes = []
@@ -4,21 +4,38 @@ This module provides us with a drainable multiprocess aware message queue.
 '''
 ##################################################################################################
 
-from multiprocessing import Event, Queue
+import time
+from collections import deque
+from multiprocessing import Event, Queue, Value
 from multiprocessing.managers import BaseManager
 from queue import Empty
-from typing import Any, List
+from typing import Any, Callable, Iterable, List
 
 from .debugging import app_logger as log
 
 
+class Batch(list):
+    '''A list of messages that travels through the queue as a single item.
+    Consumers never see it, QueueWrapper unpacks it on get.
+    '''
+    pass
+
+
+class QueueFull(Exception):
+    '''Raised by put when the queue stays over its high watermark for longer than the put timeout.
+    The caller is expected to retry later.
+    '''
+    pass
+
+
 class QueueWrapper(object):
 
-    def __init__(self, name: str, q: Queue = None, prevent_writes: Event = None):
+    def __init__(self, name: str, q: Queue = None, prevent_writes: Event = None, validator: Callable[[Any], Any] = None,
+                 high_watermark: int = None, low_watermark: int = None, put_timeout: float = None):
         self.name = name
         # set to either a queue that is passed into the constructor, or a multiprocessing queue that we create
         # this is just a fancy way of saying that if the value passed in q exists, use it, otherwise create one
-        self.q = q or Queue
+        self.q = q or Queue()
 
         # we need a way to signal when the queue is drained, and for some reason simply using a boolean wouldn't
         # work out how we'd expect it to
@@ -40,6 +57,36 @@ class QueueWrapper(object):
         # when the event is set, it is set for every process listening
         self._prevent_writes = prevent_writes or Event()
 
+        # an optional callable that checks (and possibly converts) every object put on the queue
+        # it raises if the object is invalid, which for a remote front-end means the exception is
+        # sent back through the manager proxy instead of a bad message reaching the workers
+        self._validator = validator
+
+        # messages that were unpacked from a Batch but not handed out yet
+        # this is local to each process, every copy of the wrapper has its own
+        self._pending = deque()
+
+        # BACKPRESSURE
+        # When a high watermark is given, the number of messages on the queue is tracked in
+        # shared memory. Once it reaches the high watermark producers are throttled: put blocks
+        # until consumers bring it back down to the low watermark. If that takes longer than
+        # put_timeout seconds put raises QueueFull so the producer knows to retry later.
+        # For a remote front-end this all happens inside the manager proxy call.
+        # Without a high watermark the queue is unbounded, like it used to be.
+        self._high = high_watermark
+        self._low = low_watermark if low_watermark is not None else (high_watermark or 0) // 2
+        self._put_timeout = put_timeout
+        if high_watermark:
+            self._depth = Value('q', 0)
+            self._accepting = Event()
+            self._accepting.set()
+            # metrics, so we can size worker counts against the real load
+            self._blocked_seconds = Value('d', 0.0)
+            self._throttle_events = Value('q', 0)
+            self._consumed = Value('q', 0)
+        else:
+            self._depth = None
+
     def connect(self): # can be ignored, wasn't used in tutorial part one
         '''
         Connect to multiprocessing.Queue
@@ -48,14 +95,17 @@ class QueueWrapper(object):
         # self.q.connect()
         pass
 
-    def get(self) -> Any:
+    def get(self, timeout: float = None) -> Any:
         '''
         This call blocks until it gets a message from the queue.
         If the queue is drained, it returns the sentinel string STOP
         If the queue is closed while this call is blocking, it'll return STOP
+        If a timeout is given and nothing arrives in time, it returns None
         '''
         # if the queue is drained, meaning not writable and/or empty
         # this tells whatever code is calling get that this queue is no longer usable
+        if self._pending:
+            return self._pending.popleft()
         if self.is_drained:
             return 'STOP'
 
@@ -65,24 +115,119 @@ class QueueWrapper(object):
         Because it's blocking until there's something on the queue, it could get interrupted.
         '''
         try:
-            return self.q.get() # this is not a recursive function, it is a multiprocessing method from Queue
+            msg = self.q.get(timeout=timeout) # this is not a recursive function, it is a multiprocessing method from Queue
+        except Empty:
+            # only happens when a timeout was given, the queue is still usable
+            return None
         except:
             log.info('q.get() interrupted')
             return 'STOP'
+
+        if isinstance(msg, Batch):
+            self._release(len(msg))
+            self._pending.extend(msg)
+            return self._pending.popleft() if self._pending else None
+        if msg != 'STOP':
+            self._release(1)
+        return msg
+
+    def get_many(self, max_items: int, timeout: float = None) -> List[Any]:
+        '''
+        Blocks until at least one message is available (or the timeout runs out) and
+        returns whatever else is already waiting, up to max_items messages.
+        Returns an empty list on timeout. If the sentinel STOP is pulled it is the last item.
+        '''
+        msgs = []
+        msg = self.get(timeout=timeout)
+        while msg is not None:
+            msgs.append(msg)
+            if msg == 'STOP' or len(msgs) >= max_items:
+                break
+            # anything after the first message is only taken if it's already there
+            msg = self._pending.popleft() if self._pending else self.get(timeout=0)
+        return msgs
     
     # for our put method, we only want to put messages  onto the queue if the queue is writable
     # the teacher likes to use a debug level logger for cases like these
     # we don't want to log every single put() into the production logs, however in development these
     # logs can be helpful when we set the log level to debug
-    def put(self, obj: object):
+    def put(self, obj: object, timeout: float = None):
+        '''Puts obj on the queue if it is writable.
+        Raises QueueFull if the queue is throttled for longer than the timeout (or put_timeout).
+        '''
         if self.is_writable:
             log.debug('adding message to queue')
-            self.q.put(obj)
+            if self._validator:
+                obj = self._validator(obj)
+            if self._admit(1, timeout):
+                self.q.put(obj)
     
-    # all this does is make it more convenient to use self.put() by passing lists into function
-    def put_many(self, objs: List[object]):
-        for obj in objs:
-            self.put(obj)
+    # put_many sends all the objects as a single Batch item, so we only pay for the writable
+    # check, the pickling and the pipe write once. Through the manager proxy it is also a single
+    # round trip, which lets a remote front-end push thousands of posts in one call.
+    def put_many(self, objs: Iterable[object], timeout: float = None):
+        if not self.is_writable:
+            return
+        if self._validator:
+            # validate everything first, a bad object rejects the whole batch
+            objs = [self._validator(obj) for obj in objs]
+        batch = Batch(objs)
+        if batch and self._admit(len(batch), timeout):
+            log.debug(f'adding {len(batch)} messages to queue')
+            self.q.put(batch)
+
+    def _admit(self, count: int, timeout: float = None) -> bool:
+        '''Waits while producers are throttled, then counts the messages in.
+        Returns False if the queue stopped being writable while waiting.
+        '''
+        if self._depth is None:
+            return True
+
+        if not self._accepting.is_set():
+            start = time.perf_counter()
+            accepted = self._accepting.wait(self._put_timeout if timeout is None else timeout)
+            with self._blocked_seconds.get_lock():
+                self._blocked_seconds.value += time.perf_counter() - start
+            if not accepted:
+                raise QueueFull(f'{self.name} queue is over its high watermark, retry later')
+            if not self.is_writable:
+                return False
+
+        with self._depth.get_lock():
+            self._depth.value += count
+            if self._depth.value >= self._high and self._accepting.is_set():
+                log.debug(f'{self.name} queue reached its high watermark, throttling producers')
+                self._accepting.clear()
+                self._throttle_events.value += 1
+        return True
+
+    def _release(self, count: int):
+        '''Counts messages out and lets producers continue once the low watermark is reached.'''
+        if self._depth is None:
+            return
+        with self._depth.get_lock():
+            self._depth.value -= count
+            # the depth lock covers this counter too, it is only ever changed here
+            self._consumed.value += count
+            if self._depth.value <= self._low and not self._accepting.is_set():
+                self._accepting.set()
+
+    def stats(self) -> dict:
+        '''Returns the current depth and backpressure metrics of the queue.
+        This is a method rather than a property so it can be called through the manager proxy.
+        '''
+        stats = {'name': self.name, 'empty': self.empty}
+        if self._depth is not None:
+            stats.update(
+                depth=self._depth.value,
+                high_watermark=self._high,
+                low_watermark=self._low,
+                throttled=not self._accepting.is_set(),
+                blocked_seconds=self._blocked_seconds.value,
+                throttle_events=self._throttle_events.value,
+                consumed=self._consumed.value,
+            )
+        return stats
     
     def prevent_writes(self):
         '''
@@ -94,6 +239,9 @@ class QueueWrapper(object):
         # once this instance is set, any tasks using this queue will know that it is not writable
         log.debug(f'preventing writes to {self.name} queue')
         self._prevent_writes.set()
+        # wake up any throttled producers, they'll see the queue isn't writable anymore
+        if self._depth is not None:
+            self._accepting.set()
 
     @property
     def is_writable(self) -> bool:
@@ -112,7 +260,7 @@ class QueueWrapper(object):
     def empty(self) -> bool:
         '''Read only property indicating if the queue is empty'''
         # this uses the multiprocessing.Queue method to check if the queue is empty
-        return self.q.empty()
+        return not self._pending and self.q.empty()
 
 # we don't need to add or change anything for this object, simply inherit it with QueueManager
 class QueueManager(BaseManager):
@@ -56,3 +56,58 @@ def test_draining(queue_wrapper):
 
 
 
+
+def test_put_runs_validator():
+    def validator(obj):
+        if obj == 'bad':
+            raise ValueError('bad message')
+        return obj.upper()
+
+    queue_wrapper = QueueWrapper('testq', q=Queue(), validator=validator)
+    queue_wrapper.put('message')
+    assert queue_wrapper.get() == 'MESSAGE'
+    with pytest.raises(ValueError):
+        queue_wrapper.put('bad')
+    assert queue_wrapper.empty
+
+def test_put_many_is_one_queue_item(queue_wrapper):
+    queue_wrapper.put_many(['message1', 'message2', 'message3'])
+    assert queue_wrapper.q.qsize() == 1
+    assert queue_wrapper.get() == 'message1'
+    assert not queue_wrapper.empty
+    assert queue_wrapper.get_many(10) == ['message2', 'message3']
+    assert queue_wrapper.empty
+
+def test_get_many(queue_wrapper):
+    queue_wrapper.put_many(['message1', 'message2'])
+    queue_wrapper.put('message3')
+    queue_wrapper.q.put('STOP')
+    queue_wrapper.put('message4')
+    assert queue_wrapper.get_many(2) == ['message1', 'message2']
+    assert queue_wrapper.get_many(10) == ['message3', 'STOP']
+    assert queue_wrapper.get_many(10) == ['message4']
+    assert queue_wrapper.get_many(10, timeout=0.01) == []
+
+def test_put_many_after_prevent_writes(queue_wrapper):
+    queue_wrapper.prevent_writes()
+    queue_wrapper.put_many(['message1'])
+    assert queue_wrapper.get_many(10) == ['STOP']
+
+def test_watermarks_throttle_producers():
+    from .messageq import QueueFull
+    queue_wrapper = QueueWrapper('testq', q=Queue(), high_watermark=4, low_watermark=1, put_timeout=0.01)
+    queue_wrapper.put_many(['message1', 'message2', 'message3'])
+    queue_wrapper.put('message4')
+    assert queue_wrapper.stats()['throttled']
+    with pytest.raises(QueueFull):
+        queue_wrapper.put('message5')
+
+    # producers are released once consumers get the depth down to the low watermark
+    assert queue_wrapper.get_many(3) == ['message1', 'message2', 'message3']
+    stats = queue_wrapper.stats()
+    assert not stats['throttled']
+    assert stats['depth'] == 1
+    assert stats['throttle_events'] == 1
+    assert stats['blocked_seconds'] > 0
+    queue_wrapper.put('message5')
+    assert queue_wrapper.get_many(10) == ['message4', 'message5']
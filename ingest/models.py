@@ -4,30 +4,129 @@
 '''
 ##################################################################################################
 
+import heapq
+import sys
 from collections import Counter
-from typing import Any, Dict, List, Tuple
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Tuple
 
-from pydantic import Basemodel
+# These messages are created for every article and pickled across both
+# multiprocessing queues, so they are kept as small as possible: __slots__ instead
+# of an instance __dict__, and __reduce__ pickles them as a plain tuple of values.
+# Publication names are interned, the same few names show up in every message.
+#
+# Nothing is validated on construction. Data coming from the front-end is checked
+# once by Post.validate when it is put on the input queue.
 
-class Post(Basemodel):
+class Post(object):
     '''Post is used to store content and publication from the front-end'''
-    content: str # required because we have no default value if none given
-    publication: str # required because we have no default value if none given
+    __slots__ = ('content', 'publication')
 
-class ProcessedPost(Basemodel):
+    def __init__(self, content: str, publication: str):
+        self.content = content
+        self.publication = sys.intern(publication)
+
+    @classmethod
+    def validate(cls, obj: Any) -> 'Post':
+        '''Returns obj as a Post, accepting a Post or a dict with the same fields.
+        Raises ValueError if it isn't a usable post.
+        '''
+        if isinstance(obj, cls):
+            content, publication = obj.content, obj.publication
+        elif isinstance(obj, dict):
+            content, publication = obj.get('content'), obj.get('publication')
+        else:
+            raise ValueError(f'expected a Post, got {type(obj).__name__}')
+
+        if not isinstance(content, str):
+            raise ValueError('post content must be a string')
+        if not isinstance(publication, str) or not publication.strip():
+            raise ValueError('post publication must be a non-empty string')
+        return obj if isinstance(obj, cls) else cls(content, publication)
+
+    def __reduce__(self):
+        return (Post, (self.content, self.publication))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Post):
+            return NotImplemented
+        return self.content == other.content and self.publication == other.publication
+
+    def __repr__(self) -> str:
+        return f'Post(publication={self.publication!r}, content={self.content[:40]!r})'
+
+
+class ProcessedPost(object):
     '''ProcessedPost is to store the results of DataProcessor.'''
-    publication: str
-    entities: Counter = Counter() # remember that our DataProcessor returns a Counter witl all the extracted entitities
-    article_count: int = 0 # count number of articles processed, one processed post can consume more than one article
-    # later on this will allow us to merge our results into one object
-    
+    __slots__ = ('publication', 'entities', 'article_count')
+
+    def __init__(self, publication: str, entities: Counter = None, article_count: int = 0):
+        self.publication = sys.intern(publication)
+        # remember that our DataProcessor returns a Counter with all the extracted entitities
+        self.entities: Counter = entities if entities is not None else Counter()
+        # count number of articles processed, one processed post can consume more than one article
+        # this allows us to merge our results into one object
+        self.article_count = article_count
+
+    def __reduce__(self):
+        return (ProcessedPost, (self.publication, self.entities, self.article_count))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ProcessedPost):
+            return NotImplemented
+        return (self.publication, self.entities, self.article_count) == \
+            (other.publication, other.entities, other.article_count)
+
+    def __repr__(self) -> str:
+        return (f'ProcessedPost(publication={self.publication!r}, '
+                f'entities=<{len(self.entities)} entities>, article_count={self.article_count})')
+
     @property
     def pub_key(self) -> str:
-        return None
+        '''Normalized publication name used as the database key.'''
+        return publication_key(self.publication)
     
-    def transform_for_database(self, top_n=2000) -> List[Tuple[str, str, str, Dict]]:
-        return None
+    # the values in each document are deltas, the saver adds them onto whatever is
+    # already stored, so partial aggregates from different workers can be written
+    # in any order
+    def transform_for_database(self, top_n=2000) -> Iterator[Tuple[str, str, str, Dict]]:
+        '''Yields (pubname, collname, doc_id, document_dict) tuples ready for persist.
+        Only the top_n most mentioned entities are kept, in no particular order.
+        '''
+        pub_key = self.pub_key
+        yield (pub_key, 'totals', 'articles', {'count': self.article_count})
+        for name, count in top_entities(self.entities, top_n):
+            yield (pub_key, 'entities', entity_doc_id(name), {'name': name, 'count': count})
     
-    def __add__(self, other) -> ProcessedPost:
+    # merging happens in place because the aggregation cache holds on to one
+    # ProcessedPost per publication and keeps adding to it, copying the Counter
+    # each time would defeat the point
+    def __add__(self, other) -> 'ProcessedPost':
+        '''Merges the entities and article count of other into this post.'''
+        self.entities.update(other.entities)
+        self.article_count += other.article_count
         return self
+
+
+# Publication names repeat constantly, so we only normalize each one once.
+@lru_cache(maxsize=4096)
+def publication_key(publication: str) -> str:
+    return publication.strip().lower()
+
+
+def top_entities(entities: Counter, top_n: int) -> Iterator[Tuple[str, int]]:
+    '''Yields the top_n (entity, count) pairs without sorting the whole Counter.'''
+    # when everything fits there is nothing to select, the order doesn't matter to the database
+    if len(entities) <= top_n:
+        return iter(entities.items())
+    # nlargest keeps a heap of top_n items, so this is O(n log top_n) rather than
+    # the O(n log n) of sorting every entity with most_common()
+    return iter(heapq.nlargest(top_n, entities.items(), key=itemgetter(1)))
+
+
+def entity_doc_id(name: str) -> str:
+    '''Firestore document ids may not contain a forward slash or be . or ..'''
+    doc_id = name.replace('/', '|')
+    return doc_id if doc_id.strip('.') else f'_{doc_id}'
     
@@ -0,0 +1,38 @@
+import pytest
+from collections import Counter
+from .models import Post, ProcessedPost, entity_doc_id, top_entities
+
+
+def test_top_entities_selects_largest():
+    entities = Counter({f'e{i}': i for i in range(100)})
+    assert sorted(top_entities(entities, 3)) == [('e97', 97), ('e98', 98), ('e99', 99)]
+    assert len(list(top_entities(entities, 500))) == 100
+
+
+def test_transform_for_database():
+    post = ProcessedPost(publication=' The Times ', entities=Counter({'a/b': 3, 'c': 1}), article_count=2)
+    docs = post.transform_for_database(top_n=1)
+    assert next(docs) == ('the times', 'totals', 'articles', {'count': 2})
+    assert list(docs) == [('the times', 'entities', 'a|b', {'name': 'a/b', 'count': 3})]
+
+
+def test_entity_doc_id():
+    assert entity_doc_id('..') == '_..'
+    assert entity_doc_id('ac/dc') == 'ac|dc'
+
+
+def test_messages_round_trip_through_pickle():
+    import pickle
+    post = Post(content='text', publication='pub')
+    processed = ProcessedPost(publication='pub', entities=Counter(a=1), article_count=1)
+    assert pickle.loads(pickle.dumps(post)) == post
+    assert pickle.loads(pickle.dumps(processed)) == processed
+
+
+def test_post_validate():
+    post = Post(content='text', publication='pub')
+    assert Post.validate(post) is post
+    assert Post.validate({'content': 'text', 'publication': 'pub'}) == post
+    for bad in ['text', {'content': 'text'}, {'content': 1, 'publication': 'pub'}, {'content': 'x', 'publication': ' '}]:
+        with pytest.raises(ValueError):
+            Post.validate(bad)
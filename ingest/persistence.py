@@ -1,15 +1,27 @@
 ##################################################################################################
 '''
     This module provides methods for persisting processed data to long-term storage.
+
+    Documents are stored as publications/{pubname}/{collname}/{doc_id}.
+    The numbers in a document are deltas which get added onto the stored values with
+    firestore.Increment, so writes coming from different savers never conflict.
 '''
 ##################################################################################################
 
+import time
+from typing import Dict, Iterable, List, Tuple
 
 from google.cloud import firestore
 
 from .debugging import app_logger as log
 from .models import ProcessedPost
 
+# Firestore refuses to commit a batch with more than 500 writes in it.
+MAX_BATCH_WRITES = 500
+
+# (pubname, collname, doc_id, document_dict) as produced by ProcessedPost.transform_for_database
+Document = Tuple[str, str, str, Dict]
+
 # this is just a dummy function that we can call in our development environment
 # this is for testing, when we really don't want to write to the database
 # makes testing easier
@@ -21,15 +33,88 @@ def persist_no_op(*args, **kwargs):
 # to make any configuration changes
 # it will automatically use the credentials of the service account which are used by
 # compute engine (what the hell is compute engine?) https://cloud.google.com/compute
-# this will be implemented in another sprint but for now these are the dummies/stubs
-# we can use to call these functions to test our integration works
 def get_database_client():
     return firestore.Client()
 
 
+def document_ref(client, pubname, collname, doc_id):
+    return client.collection('publications').document(pubname).collection(collname).document(doc_id)
+
+
+def as_update(document_dict: Dict) -> Dict:
+    '''Turns the numbers of a document into Increment transforms.'''
+    return {
+        k: firestore.Increment(v) if _is_number(v) else v
+        for k, v in document_dict.items()
+    }
+
+
 def persist(client, pubname, collname, doc_id, document_dict):
-    pass
+    '''Writes a single document, one round trip per call.'''
+    document_ref(client, pubname, collname, doc_id).set(as_update(document_dict), merge=True)
+
+
+def persist_batch(client, docs: List[Document]):
+    '''Writes the given documents using batched commits of up to MAX_BATCH_WRITES.'''
+    for start in range(0, len(docs), MAX_BATCH_WRITES):
+        batch = client.batch()
+        for pubname, collname, doc_id, document_dict in docs[start:start + MAX_BATCH_WRITES]:
+            batch.set(document_ref(client, pubname, collname, doc_id), as_update(document_dict), merge=True)
+        batch.commit()
 
 
 def increment_publication(client, pubname, count):
-    pass    
\ No newline at end of file
+    pass
+
+
+def _is_number(v) -> bool:
+    # bool is a subclass of int, but flags are not something we want to add up
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+class WriteBuffer(object):
+    '''
+    WriteBuffer collects documents in memory before they are persisted.
+    Documents targeting the same path are merged into one write: numbers are added up
+    and any other value is replaced by the latest one.
+    '''
+
+    def __init__(self):
+        self._docs: Dict[Tuple[str, str, str], Dict] = {}
+        self._oldest: float = None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @property
+    def age(self) -> float:
+        '''Seconds since the oldest buffered document was added, 0 when empty.'''
+        if self._oldest is None:
+            return 0.0
+        return time.monotonic() - self._oldest
+
+    def add(self, pubname, collname, doc_id, document_dict) -> int:
+        '''Buffers the document and returns the number of pending writes.'''
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        key = (pubname, collname, doc_id)
+        pending = self._docs.get(key)
+        if pending is None:
+            # copy it, we are going to mutate it when merging
+            self._docs[key] = dict(document_dict)
+            return len(self._docs)
+
+        for k, v in document_dict.items():
+            if _is_number(v) and _is_number(pending.get(k)):
+                pending[k] += v
+            else:
+                pending[k] = v
+        return len(self._docs)
+
+    def drain(self) -> List[Document]:
+        '''Returns all the buffered documents and empties the buffer.'''
+        docs = [(*key, doc) for key, doc in self._docs.items()]
+        self._docs = {}
+        self._oldest = None
+        return docs
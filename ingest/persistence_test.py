@@ -0,0 +1,54 @@
+import pytest
+from .fakestore import FakeClient
+from .persistence import MAX_BATCH_WRITES, WriteBuffer, persist, persist_batch
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+@pytest.fixture(scope='function')
+def client():
+    return FakeClient()
+
+
+def test_write_buffer_merges_same_document():
+    buffer = WriteBuffer()
+    buffer.add('a', 'entities', 'x', {'name': 'x', 'count': 1})
+    buffer.add('a', 'entities', 'x', {'name': 'x', 'count': 2})
+    assert buffer.add('b', 'entities', 'x', {'name': 'x', 'count': 1}) == 2
+    assert buffer.drain() == [
+        ('a', 'entities', 'x', {'name': 'x', 'count': 3}),
+        ('b', 'entities', 'x', {'name': 'x', 'count': 1}),
+    ]
+    assert len(buffer) == 0
+    assert buffer.age == 0
+
+
+def test_persist_increments(client):
+    persist(client, 'a', 'totals', 'articles', {'count': 2})
+    persist(client, 'a', 'totals', 'articles', {'count': 3})
+    assert client.docs[('publications', 'a', 'totals', 'articles')] == {'count': 5}
+    assert client.round_trips == 2
+
+
+def test_coalesced_batches_reduce_round_trips(client):
+    # 3 messages for each of 600 documents
+    msgs = [('a', 'entities', f'e{i}', {'name': f'e{i}', 'count': 1}) for i in range(600)] * 3
+    buffer = WriteBuffer()
+    for msg in msgs:
+        buffer.add(*msg)
+    persist_batch(client, buffer.drain())
+
+    # 600 merged writes need two commits of at most 500 writes
+    assert client.round_trips == 2
+    assert client.writes == 600
+    assert client.docs[('publications', 'a', 'entities', 'e0')] == {'name': 'e0', 'count': 3}
+    assert MAX_BATCH_WRITES == 500
@@ -8,21 +8,92 @@
 '''
 ##################################################################################################
 from collections import Counter
-from typing import Dict
+from typing import Dict, Iterator, List, Optional
 
 import spacy
+from spacy.language import Language
 
 from .debugging import app_logger as log
+from .entitycache import EntityCache
+from .models import Post, ProcessedPost
+
+# PIPELINE PROFILES
+# full: everything the model ships with (tagger, parser, lemmatizer, ...)
+# ner:  only the components that doc.ents depends on. The shared token to vector
+#       layers (tok2vec or transformer) are kept because the ner component listens to them.
+#       Everything else is removed from the pipeline, so it takes no time and no memory.
+PROFILES = {
+    'full': None,
+    'ner': ['tok2vec', 'transformer', 'ner', 'entity_ruler'],
+}
+
+DEFAULT_SKIP = ['CARDINAL', 'MONEY', 'ORDINAL', 'DATE', 'TIME']
+
+
+# spacy's ner model can't be told to ignore some of its labels, so the next best thing is
+# dropping them right after the ner step, inside the pipeline, before anything reads doc.ents
+@Language.factory('skip_entity_labels', default_config={'labels': []})
+def create_skip_entity_labels(nlp: Language, name: str, labels: List[str]):
+    labels = set(labels)
+
+    def skip_entity_labels(doc):
+        doc.ents = [e for e in doc.ents if e.label_ not in labels]
+        return doc
+    return skip_entity_labels
+
+
+def load_pipeline(model: str, profile: str = 'full', skip: List[str] = None) -> Language:
+    '''Loads the spacy model trimmed down to the given profile.
+    If skip labels are given they are filtered out by a component after the ner step.
+    '''
+    if profile not in PROFILES:
+        raise ValueError(f'unknown pipeline profile {profile}, expected one of {list(PROFILES)}')
+
+    keep = PROFILES[profile]
+    if keep is None:
+        nlp = spacy.load(model)
+    else:
+        nlp = spacy.load(model, enable=keep)
+        # disabled components still take up memory, removing them frees it
+        for name in list(nlp.disabled):
+            nlp.remove_pipe(name)
+
+    if skip:
+        nlp.add_pipe('skip_entity_labels', config={'labels': list(skip)})
+    return nlp
+
 
 class DataProcessor():
     
-    def __init__(self) -> None:
-        log.info('spacy: loading model')
-        # en_core_web_sm is the name of the model, found online in a model list
-        self.nlp = spacy.load('en_core_web_sm') # instance variable called nlp that is itself an instance of a spacy nlp model
-        log.info('spacy: loaded model') # good practice to have logs before and after information that might consume a lot of memory
-        self.skip = ['CARDINAL', 'MONEY', 'ORDINAL', 'DATE', 'TIME'] # This is a list of labels to ignore
-        pass
+    def __init__(self, cache_size: int = 0, cache_path: str = None, model: str = 'en_core_web_sm',
+                 profile: str = 'full', skip_in_pipeline: bool = False) -> None:
+        self.skip = list(DEFAULT_SKIP) # This is a list of labels to ignore
+
+        log.info(f'spacy: loading model {model} with the {profile} profile')
+        # en_core_web_sm is the default model, found online in a model list
+        # instance variable called nlp that is itself an instance of a spacy nlp model
+        self.nlp = load_pipeline(model, profile, self.skip if skip_in_pipeline else None)
+        log.info(f'spacy: loaded model, pipeline {self.nlp.pipe_names}') # good practice to have logs before and after information that might consume a lot of memory
+
+        # when the pipeline already dropped the skipped labels there's no need to check them again
+        self._skip_labels = set() if skip_in_pipeline else set(self.skip)
+
+        # the entity cache is optional, cache_size is the number of texts kept in memory
+        # and cache_path is a SQLite file shared with the other workers
+        self.cache: Optional[EntityCache] = None
+        if cache_size or cache_path:
+            self.cache = EntityCache(self.cache_namespace(), max_items=cache_size, path=cache_path)
+
+    def cache_namespace(self) -> str:
+        '''Identifies everything that affects the extracted entities.
+        Cached entities from a different model, pipeline or skip list are never reused.
+        '''
+        meta = self.nlp.meta
+        return '|'.join([
+            f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}",
+            ','.join(self.nlp.pipe_names),
+            ','.join(sorted(self.skip)),
+        ])
 
     # create a list comprehension, that will return the entity text
     # for each entity in the doc.ents
@@ -30,13 +101,60 @@ class DataProcessor():
     # we will pass this list to a Counter which will return a dictonary
     # in this dictionary, the string list elements are the keys and their count number is the value
     def entities(self, doc) -> Counter:
-        t = [e.text.lower() for e in doc.ents if e.label_ not in self.skip]
+        t = [e.text.lower() for e in doc.ents if e.label_ not in self._skip_labels]
         return Counter(t) # tracks the number of times each entity is mentioned in the target text
 
     # this method takes in string arguments and returns a dictionary data structure to store entities counters 't' inside scalably
     def process(self, text: str) -> Dict:
         return {'entities': self.entities(self.nlp(text))}
 
-    def process_message(self, post):
-        return None
+    def extract(self, text: str) -> Counter:
+        '''Returns the entities of the text, from the cache when we've seen the text before.'''
+        if self.cache is None:
+            return self.entities(self.nlp(text))
+
+        key = self.cache.key(text)
+        entities = self.cache.get(key)
+        if entities is None:
+            entities = self.entities(self.nlp(text))
+            self.cache.put(key, entities)
+        return entities
+
+    def process_message(self, post: Post) -> ProcessedPost:
+        '''Extracts the entities for a single post. Every post counts as one article.'''
+        return ProcessedPost(
+            publication=post.publication,
+            entities=self.extract(post.content),
+            article_count=1,
+        )
+
+    # nlp.pipe streams the texts through the model in batches, which saves a lot of
+    # per call overhead compared to calling self.nlp once for every text.
+    # The docs come back in the same order as the texts went in, so we can zip them
+    # back up with the posts they came from.
+    def process_messages(self, posts: List[Post], batch_size: int = 64) -> Iterator[ProcessedPost]:
+        '''Extracts the entities for many posts at once using nlp.pipe.
+        Yields one ProcessedPost per given post, in the same order.
+        '''
+        results: List[Counter] = [None] * len(posts)
+        keys = []
+        if self.cache is not None:
+            keys = [self.cache.key(post.content) for post in posts]
+            results = [self.cache.get(key) for key in keys]
+
+        # only the cache misses go through the model
+        misses = [i for i, entities in enumerate(results) if entities is None]
+        docs = self.nlp.pipe((posts[i].content for i in misses), batch_size=batch_size)
+        for i, doc in zip(misses, docs):
+            results[i] = self.entities(doc)
+
+        if self.cache is not None and misses:
+            self.cache.put_many((keys[i], results[i]) for i in misses)
+
+        for post, entities in zip(posts, results):
+            yield ProcessedPost(
+                publication=post.publication,
+                entities=entities,
+                article_count=1,
+            )
 
@@ -0,0 +1,60 @@
+import pytest
+import spacy
+from collections import Counter
+from .models import Post
+from .processor import DataProcessor
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+# a tiny rule based model, so the tests don't need a trained model to be downloaded
+@pytest.fixture(scope='module')
+def model(tmp_path_factory):
+    nlp = spacy.blank('en')
+    nlp.add_pipe('sentencizer')
+    ruler = nlp.add_pipe('entity_ruler', name='ner')
+    ruler.add_patterns([
+        {'label': 'ORG', 'pattern': 'Google'},
+        {'label': 'GPE', 'pattern': 'Paris'},
+        {'label': 'DATE', 'pattern': 'Monday'},
+    ])
+    path = tmp_path_factory.mktemp('model') / 'test_model'
+    nlp.to_disk(path)
+    return str(path)
+
+
+POSTS = [
+    Post(content='Google opened an office in Paris on Monday.', publication='pub'),
+    Post(content='Paris, Paris and Google again on Monday.', publication='pub'),
+]
+
+
+def test_process_message(model):
+    processor = DataProcessor(model=model)
+    assert processor.process_message(POSTS[0]).entities == Counter(google=1, paris=1)
+
+
+@pytest.mark.parametrize('profile,skip_in_pipeline', [('full', False), ('ner', False), ('ner', True)])
+def test_profiles_extract_the_same_entities(model, profile, skip_in_pipeline):
+    full = DataProcessor(model=model)
+    trimmed = DataProcessor(model=model, profile=profile, skip_in_pipeline=skip_in_pipeline)
+    if profile == 'ner':
+        assert 'sentencizer' not in trimmed.nlp.component_names
+    assert [p.entities for p in trimmed.process_messages(POSTS)] == \
+        [p.entities for p in full.process_messages(POSTS)]
+
+
+def test_cache_is_used(model):
+    processor = DataProcessor(model=model, cache_size=10)
+    first = [p.entities for p in processor.process_messages(POSTS)]
+    assert [p.entities for p in processor.process_messages(POSTS)] == first
+    assert processor.cache.stats()['hits'] == 2
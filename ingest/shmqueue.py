@@ -0,0 +1,136 @@
+##################################################################################################
+'''
+    This module provides a message queue backed by multiprocessing.shared_memory.
+
+    It is a bounded ring buffer of length prefixed, pickled frames that any number of
+    processes can put to and get from. It implements the parts of the multiprocessing.Queue
+    API that QueueWrapper uses (put, get, empty, qsize), so it can be handed to a QueueWrapper
+    in place of a regular Queue and the Worker/Saver code doesn't need to know the difference.
+
+    Unlike multiprocessing.Queue there is no feeder thread and no pipe, a put copies the
+    pickled bytes straight into shared memory. Because the buffer is bounded, put blocks
+    while there isn't enough free space for the frame.
+
+    SHARED MEMORY LAYOUT
+    [head: u64][tail: u64][count: u64][............ data: capacity bytes ............]
+    head and tail are ever increasing byte offsets, the position in the data region is the
+    offset modulo capacity. Frames wrap around the end of the data region.
+'''
+##################################################################################################
+
+import atexit
+import os
+import pickle
+import struct
+from multiprocessing import Condition, Lock
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty, Full
+from typing import Any
+
+HEADER = struct.Struct('QQQ')
+FRAME_LENGTH = struct.Struct('I')
+
+
+class ShmQueue(object):
+
+    def __init__(self, capacity: int = 64 * 2**20):
+        self.capacity = capacity
+        self._shm = SharedMemory(create=True, size=HEADER.size + capacity)
+        HEADER.pack_into(self._shm.buf, 0, 0, 0, 0)
+
+        # a single lock guards the header, the two conditions share it
+        # so producers and consumers can wait for space or for frames
+        lock = Lock()
+        self._not_empty = Condition(lock)
+        self._not_full = Condition(lock)
+
+        # only the process that created the memory is allowed to unlink it
+        self._owner = os.getpid()
+        atexit.register(self.unlink)
+
+    def __getstate__(self):
+        # used when the queue is sent to a spawned process
+        # the lock and conditions can only be pickled while spawning a process
+        state = self.__dict__.copy()
+        state['_shm'] = self._shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = SharedMemory(name=state['_shm'])
+        # attaching registers the memory with this process' resource tracker which would
+        # unlink it when this process exits, the creator is responsible for that
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+    def put(self, obj: Any, block: bool = True, timeout: float = None):
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        size = FRAME_LENGTH.size + len(data)
+        if size > self.capacity:
+            raise ValueError(f'message of {size} bytes does not fit in a {self.capacity} byte queue')
+
+        with self._not_full:
+            if not self._wait(self._not_full, lambda: self._free() >= size, block, timeout):
+                raise Full
+            head, tail, count = HEADER.unpack_from(self._shm.buf, 0)
+            self._write(tail, FRAME_LENGTH.pack(len(data)))
+            self._write(tail + FRAME_LENGTH.size, data)
+            HEADER.pack_into(self._shm.buf, 0, head, tail + size, count + 1)
+            self._not_empty.notify()
+
+    def get(self, block: bool = True, timeout: float = None) -> Any:
+        with self._not_empty:
+            if not self._wait(self._not_empty, lambda: self.qsize() > 0, block, timeout):
+                raise Empty
+            head, tail, count = HEADER.unpack_from(self._shm.buf, 0)
+            length, = FRAME_LENGTH.unpack(self._read(head, FRAME_LENGTH.size))
+            data = self._read(head + FRAME_LENGTH.size, length)
+            HEADER.pack_into(self._shm.buf, 0, head + FRAME_LENGTH.size + length, tail, count - 1)
+            self._not_full.notify_all()
+        # unpickling can be slow for big messages, no need to hold the lock for it
+        return pickle.loads(data)
+
+    def get_nowait(self) -> Any:
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        return HEADER.unpack_from(self._shm.buf, 0)[2]
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        if os.getpid() == self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _free(self) -> int:
+        head, tail, _ = HEADER.unpack_from(self._shm.buf, 0)
+        return self.capacity - (tail - head)
+
+    def _wait(self, cond: Condition, predicate, block: bool, timeout: float) -> bool:
+        if not block:
+            return predicate()
+        if timeout is None:
+            return cond.wait_for(predicate)
+        return cond.wait_for(predicate, max(timeout, 0))
+
+    def _write(self, offset: int, data: bytes):
+        start = HEADER.size + offset % self.capacity
+        first = min(len(data), HEADER.size + self.capacity - start)
+        self._shm.buf[start:start + first] = data[:first]
+        if first < len(data):
+            self._shm.buf[HEADER.size:HEADER.size + len(data) - first] = data[first:]
+
+    def _read(self, offset: int, length: int) -> bytes:
+        start = HEADER.size + offset % self.capacity
+        first = min(length, HEADER.size + self.capacity - start)
+        data = bytes(self._shm.buf[start:start + first])
+        if first < length:
+            data += bytes(self._shm.buf[HEADER.size:HEADER.size + length - first])
+        return data
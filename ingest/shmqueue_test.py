@@ -0,0 +1,61 @@
+import pytest
+from multiprocessing import Process
+from queue import Empty, Full
+from .messageq import QueueWrapper
+from .shmqueue import ShmQueue
+
+
+@pytest.fixture(scope='function')
+def shm_queue():
+    q = ShmQueue(capacity=256)
+    yield q
+    q.close()
+    q.unlink()
+
+
+def produce(q, count):
+    for i in range(count):
+        q.put(('message', i))
+
+
+def test_fifo_with_wrap_around(shm_queue):
+    # each frame is well over 20 bytes, so 100 messages wrap the 256 byte buffer many times
+    for i in range(100):
+        shm_queue.put(('message', i))
+        shm_queue.put(['x' * 30])
+        assert shm_queue.get() == ('message', i)
+        assert shm_queue.get() == ['x' * 30]
+    assert shm_queue.empty()
+
+
+def test_full_and_empty(shm_queue):
+    with pytest.raises(Empty):
+        shm_queue.get(timeout=0.01)
+    with pytest.raises(ValueError):
+        shm_queue.put('x' * 300)
+    while True:
+        try:
+            shm_queue.put('x' * 50, timeout=0.01)
+        except Full:
+            break
+    assert shm_queue.qsize() > 0
+
+
+def test_across_processes(shm_queue):
+    producers = [Process(target=produce, args=(shm_queue, 200)) for _ in range(2)]
+    for p in producers:
+        p.start()
+    received = [shm_queue.get(timeout=5) for _ in range(400)]
+    for p in producers:
+        p.join()
+    assert sorted(received) == sorted([('message', i) for i in range(200)] * 2)
+
+
+def test_queue_wrapper_api(shm_queue):
+    queue_wrapper = QueueWrapper('testq', q=shm_queue)
+    queue_wrapper.put_many(['message1', 'message2'])
+    assert queue_wrapper.get_many(10) == ['message1', 'message2']
+    assert queue_wrapper.get(timeout=0.01) is None
+    queue_wrapper.prevent_writes()
+    assert queue_wrapper.is_drained
+    assert queue_wrapper.get() == 'STOP'
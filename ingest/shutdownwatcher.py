@@ -57,10 +57,15 @@ class ShutdownWatcher:
         # remember try and catch is embedded inside of the with keyword 
         self.exit()
 
-    def serve_forever(self):
+    def serve_forever(self, callback=None, interval: float = 10.0):
         # this is the implementation of our core functionality 
+        # if a callback is given it is called every interval seconds while we wait
+        next_call = time.monotonic() + interval
         while self.should_continue == True:
             time.sleep(0.1)
+            if callback and time.monotonic() >= next_call:
+                callback()
+                next_call = time.monotonic() + interval
     
     def exit(self, *args, **kwargs):
         # this simply sets the should continue value to false
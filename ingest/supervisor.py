@@ -0,0 +1,161 @@
+##################################################################################################
+'''
+    This module keeps the worker and saver pools healthy while the backend runs.
+
+    Every few seconds the Supervisor:
+    1.) Restarts any Worker/Saver process that died.
+    2.) Looks at how deep the queue feeding each pool is, and adds or removes a process
+        when the depth stays past a threshold for a few checks in a row.
+    3.) Logs queue stats and throughput now and then.
+
+    Example usage:
+
+    supervisor = Supervisor([worker_pool, saver_pool])
+    with ShutdownWatcher() as watcher:
+        watcher.serve_forever(supervisor.tick, interval=1.0)
+'''
+##################################################################################################
+
+import os
+import signal
+import time
+from multiprocessing import Process
+from typing import List
+
+from .debugging import app_logger as log
+from .messageq import QueueWrapper
+
+
+class Pool(object):
+    '''
+    Pool is a group of processes of the same class consuming the same queue.
+    It scales between min_procs and max_procs based on the depth of that queue.
+
+    The pool scales up when the depth is at least up_depth, and down when it is at most
+    down_depth. The gap between the two thresholds plus the patience (consecutive checks
+    that have to agree) and the cooldown (seconds between two scaling steps) keep it from
+    flapping back and forth.
+    '''
+
+    def __init__(self, name: str, proc: Process, proc_args: List[object], q: QueueWrapper,
+                 min_procs: int, max_procs: int, up_depth: int, down_depth: int,
+                 patience: int = 3, cooldown: float = 10.0):
+        self.name = name
+        self.proc = proc
+        self.proc_args = proc_args
+        self.q = q
+        self.min_procs = max(min_procs, 1)
+        self.max_procs = max(max_procs, self.min_procs)
+        self.up_depth = up_depth
+        self.down_depth = down_depth
+        self.patience = patience
+        self.cooldown = cooldown
+
+        # this list is shared with the shutdown handlers, so it is only ever changed in place
+        self.procs: List[Process] = []
+        self.target = self.min_procs
+        self.restarts = 0
+        self._pressure = 0  # positive while scaling up is called for, negative for scaling down
+        self._last_scaled = 0.0
+
+    def start(self, count: int) -> List[Process]:
+        '''Starts the pool with the given number of processes, clamped to the bounds.'''
+        self.target = min(max(count, self.min_procs), self.max_procs)
+        log.info(f'initializing {self.target} {self.name} processe(s)')
+        self._fill()
+        return self.procs
+
+    def _fill(self):
+        while len(self.procs) < self.target:
+            p = self.proc(*self.proc_args)
+            p.start()
+            self.procs.append(p)
+
+    def reap(self) -> int:
+        '''Removes processes that exited, starts replacements, and returns the number of crashes.'''
+        crashed = 0
+        for p in [p for p in self.procs if not p.is_alive()]:
+            p.join()
+            self.procs.remove(p)
+            # an exit code of 0 is a process we asked to stop when scaling down
+            if p.exitcode != 0:
+                crashed += 1
+                log.warning(f'{self.name} process {p.pid} died with exit code {p.exitcode}, restarting it')
+        self.restarts += crashed
+        self._fill()
+        return crashed
+
+    def depth(self) -> int:
+        stats = self.q.stats()
+        if 'depth' in stats:
+            return stats['depth']
+        try:
+            return self.q.q.qsize()
+        except NotImplementedError:
+            # qsize isn't available on macOS
+            return 0 if self.q.empty else self.up_depth
+
+    def scale(self, depth: int) -> int:
+        '''Adjusts the target size of the pool for the given depth.
+        Returns +1 or -1 when the pool was scaled, otherwise 0.
+        '''
+        if depth >= self.up_depth:
+            self._pressure = max(self._pressure, 0) + 1
+        elif depth <= self.down_depth:
+            self._pressure = min(self._pressure, 0) - 1
+        else:
+            self._pressure = 0
+
+        if abs(self._pressure) < self.patience or time.monotonic() - self._last_scaled < self.cooldown:
+            return 0
+
+        step = 1 if self._pressure > 0 else -1
+        if not self.min_procs <= self.target + step <= self.max_procs:
+            return 0
+
+        self.target += step
+        self._pressure = 0
+        self._last_scaled = time.monotonic()
+        log.info(f'scaling {self.name} pool to {self.target} process(es), queue depth {depth}')
+        if step > 0:
+            self._fill()
+        else:
+            # the signaled process puts a STOP on the queue, and whichever process pulls
+            # it exits cleanly, either way the pool ends up one process smaller
+            victim = next((p for p in reversed(self.procs) if p.is_alive()), None)
+            if victim:
+                os.kill(victim.pid, signal.SIGTERM)
+        return step
+
+
+class Supervisor(object):
+
+    def __init__(self, pools: List[Pool], stats_interval: float = 60.0):
+        self.pools = pools
+        self.stats_interval = stats_interval
+        self._last_stats = time.monotonic()
+        self._last_consumed = {}
+
+    def tick(self):
+        '''Runs one round of health checks and scaling for every pool.'''
+        for pool in self.pools:
+            pool.reap()
+            pool.scale(pool.depth())
+
+        if time.monotonic() - self._last_stats >= self.stats_interval:
+            self.log_stats()
+
+    def log_stats(self):
+        now = time.monotonic()
+        elapsed = now - self._last_stats
+        for pool in self.pools:
+            stats = pool.q.stats()
+            # consumed is only tracked for queues with watermarks
+            consumed = stats.get('consumed')
+            if consumed is not None:
+                rate = (consumed - self._last_consumed.get(pool.name, 0)) / elapsed
+                self._last_consumed[pool.name] = consumed
+                stats['msgs_per_sec'] = round(rate, 1)
+            log.info(f'{pool.name} pool: {len(pool.procs)}/{pool.target} processes, '
+                     f'{pool.restarts} restarts, queue stats: {stats}')
+        self._last_stats = now
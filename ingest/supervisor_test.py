@@ -0,0 +1,79 @@
+import os
+import signal
+import time
+import pytest
+from multiprocessing import Process
+from .messageq import QueueWrapper
+from .supervisor import Pool
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+# a stand in for Worker/Saver, it consumes the queue until it pulls STOP
+class Consumer(Process):
+
+    def __init__(self, q: QueueWrapper):
+        self.q = q
+        super(Consumer, self).__init__()
+
+    def shutdown(self, *args):
+        self.q.q.put('STOP')
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.shutdown)
+        for _ in iter(self.q.get, 'STOP'):
+            pass
+        exit(0)
+
+
+@pytest.fixture(scope='function')
+def pool():
+    q = QueueWrapper('testq', high_watermark=1_000)
+    pool = Pool('consumer', Consumer, [q], q, min_procs=1, max_procs=3,
+                up_depth=100, down_depth=0, patience=2, cooldown=0)
+    yield pool
+    for p in pool.procs:
+        q.q.put('STOP')
+    for p in pool.procs:
+        p.join()
+
+
+def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_reap_restarts_crashed_processes(pool):
+    pool.start(2)
+    crashed = pool.procs[0]
+    os.kill(crashed.pid, signal.SIGKILL)
+    assert wait_for(lambda: not crashed.is_alive())
+    assert pool.reap() == 1
+    assert len(pool.procs) == 2
+    assert crashed not in pool.procs
+
+
+def test_scale_with_patience(pool):
+    pool.start(1)
+    assert pool.scale(500) == 0  # one check isn't enough
+    assert pool.scale(500) == 1
+    assert len(pool.procs) == 2
+    assert pool.scale(50) == 0  # between the thresholds resets the pressure
+    assert pool.scale(0) == 0
+    assert pool.scale(0) == -1
+    assert wait_for(lambda: len([p for p in pool.procs if p.is_alive()]) == 1)
+    pool.reap()
+    assert len(pool.procs) == 1 and pool.restarts == 0
+    # never below min_procs
+    assert pool.scale(0) == 0 and pool.scale(0) == 0